@@ -1,4 +1,9 @@
+import functools
+import importlib
+import math
 import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from qgis.PyQt.QtCore import QCoreApplication
 from qgis.core import (QgsProcessing, 
                       QgsProcessingAlgorithm, 
@@ -9,7 +14,574 @@ from qgis.core import (QgsProcessing,
                       QgsProcessingException)
 from qgis.PyQt.QtGui import QIcon
 import numpy as np
-from osgeo import gdal
+from osgeo import gdal, gdal_array
+
+# Types GDAL entiers traités par histogramme exact plutôt que par np.percentile
+INTEGER_TYPES = (gdal.GDT_Byte, gdal.GDT_UInt16, gdal.GDT_Int16)
+
+# Nombre de classes de l'histogramme utilisé pour les percentiles des bandes réelles
+FLOAT_HIST_LEVELS = 65536
+
+# GeoTIFF de sortie tuilé, une tuile par bande, compressé en parallèle par GDAL
+OUTPUT_BLOCK_SIZE = 512
+# Les fenêtres ne s'alignent sur les tuiles de sortie que si le ppcm reste dans ce facteur
+MAX_ALIGN_FACTOR = 4
+# Octets par pixel des tampons de thread_buffer hors lecture : mask, valid, index, output (uint8),
+# indices (int32) et scratch (float64 au plus)
+THREAD_BUFFER_BYTES = 1 + 1 + 1 + 1 + 4 + 8
+GTIFF_OPTIONS = ['TILED=YES',
+                 f'BLOCKXSIZE={OUTPUT_BLOCK_SIZE}',
+                 f'BLOCKYSIZE={OUTPUT_BLOCK_SIZE}',
+                 'INTERLEAVE=BAND',
+                 'COMPRESS=LZW',
+                 'PREDICTOR=2',
+                 'NUM_THREADS=ALL_CPUS',
+                 'BIGTIFF=IF_SAFER']
+
+# Rasters lus d'un seul appel ds.ReadAsArray() plutôt que bande par bande
+MAX_CUBE_BANDS = 8
+MAX_CUBE_BYTES = 2 * 1024 ** 3
+
+# Tampons de travail propres à chaque thread, réutilisés d'un bloc et d'une bande à l'autre
+_thread_buffers = threading.local()
+
+
+def integer_domain(data_type):
+    """Décalage et taille du domaine d'indices d'un type GDAL entier."""
+    if data_type == gdal.GDT_Byte:
+        return 0, 256
+    # Décalage pour Int16 afin que np.bincount reçoive des indices positifs
+    return (32768 if data_type == gdal.GDT_Int16 else 0), 65536
+
+
+def thread_buffer(name, shape, dtype):
+    """Tampon de travail du thread courant, réalloué seulement s'il devient trop petit."""
+    size = int(np.prod(shape))
+    buffer = getattr(_thread_buffers, name, None)
+    if buffer is None or buffer.size < size or buffer.dtype != dtype:
+        buffer = np.empty(size, dtype=dtype)
+        setattr(_thread_buffers, name, buffer)
+    return buffer[:size].reshape(shape)
+
+
+def work_dtype(dtype):
+    """Type réel des calculs intermédiaires : float32 dès qu'il représente exactement l'entrée."""
+    return np.float32 if np.can_cast(dtype, np.float32) else np.float64
+
+
+def to_indices(values, offset):
+    """Indices positifs pour np.bincount et les LUT d'un tableau entier."""
+    if not offset:
+        return values
+    # Décalage écrit directement dans le tampon int32 du thread
+    return np.add(values, offset, out=thread_buffer('indices', values.shape, np.int32), dtype=np.int32)
+
+
+def aligned_block(block, size):
+    """Dimension de bloc alignée sur les tuiles de sortie, si leur ppcm reste proche du bloc."""
+    if block >= size:
+        return size
+    lcm = block * OUTPUT_BLOCK_SIZE // math.gcd(block, OUTPUT_BLOCK_SIZE)
+    # Blocs de 300 ou 1000 pixels : le ppcm exploserait, on garde le bloc d'entrée
+    return min(size, lcm if lcm <= MAX_ALIGN_FACTOR * max(block, OUTPUT_BLOCK_SIZE) else block)
+
+
+def block_windows(band, workers=1):
+    """Fenêtres de lecture alignées sur les blocs GDAL de la bande et, si possible, sur les tuiles de sortie.
+
+    Chaque tuile de sortie est alors écrite en une seule fois, sans recompression.
+    Le budget mémoire est partagé entre les bandes traitées en parallèle et n'est jamais dépassé,
+    tampons de travail compris.
+    """
+    cols, rows = band.XSize, band.YSize
+    dtype = gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType)
+    # Par pixel : le bloc lu plus tous les tampons de travail du thread
+    pixel_bytes = np.dtype(dtype).itemsize + THREAD_BUFFER_BYTES
+    # Pixels par fenêtre : la moitié du cache GDAL pour l'ensemble des bandes en cours
+    budget = max(1, (gdal.GetCacheMax() // 2) // (pixel_bytes * workers))
+    block_x, block_y = band.GetBlockSize()
+    bx, by = aligned_block(block_x, cols), aligned_block(block_y, rows)
+    if bx * by > budget:
+        # Une tuile de sortie écrite deux fois coûte moins cher qu'une bande entière en mémoire
+        bx, by = min(block_x, cols), min(block_y, rows)
+    blocks = budget // (bx * by)
+    if blocks == 0:
+        # Un seul bloc d'entrée dépasse déjà le budget : la fenêtre en est une partie
+        chx = min(bx, budget)
+        chy = max(1, min(by, budget // chx))
+    else:
+        if bx >= cols:
+            kx, ky = 1, blocks
+        else:
+            kx = ky = max(1, int(math.sqrt(blocks)))
+        chx, chy = min(cols, kx * bx), min(rows, ky * by)
+    return [(x, y, min(chx, cols - x), min(chy, rows - y))
+            for y in range(0, rows, chy)
+            for x in range(0, cols, chx)]
+
+
+class ArrayBand:
+    """Bande déjà chargée en mémoire, exposant les méthodes de gdal.Band utilisées ici."""
+
+    def __init__(self, band, data):
+        self.DataType = band.DataType
+        self.XSize, self.YSize = band.XSize, band.YSize
+        self._block_size = band.GetBlockSize()
+        self._nodata = band.GetNoDataValue()
+        self._data = data
+
+    def GetBlockSize(self):
+        return self._block_size
+
+    def GetNoDataValue(self):
+        return self._nodata
+
+    def ReadAsArray(self, xoff, yoff, win_xsize, win_ysize, buf_obj=None):
+        # Vue directe sur le cube : aucune copie n'est nécessaire
+        return self._data[yoff:yoff + win_ysize, xoff:xoff + win_xsize]
+
+
+def read_cube(ds):
+    """Toutes les bandes en une seule lecture GDAL, ou None si le raster est trop gros.
+
+    GDAL peut alors décoder les bandes en parallèle (GDAL_NUM_THREADS).
+    """
+    bands = [ds.GetRasterBand(i) for i in range(1, ds.RasterCount + 1)]
+    data_type = bands[0].DataType
+    if len(bands) > MAX_CUBE_BANDS or any(band.DataType != data_type for band in bands):
+        return None
+    itemsize = np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(data_type)).itemsize
+    if ds.RasterXSize * ds.RasterYSize * len(bands) * itemsize >= MAX_CUBE_BYTES:
+        return None
+    cube = ds.ReadAsArray().reshape(len(bands), ds.RasterYSize, ds.RasterXSize)
+    return [ArrayBand(band, data) for band, data in zip(bands, cube)]
+
+
+def gdal_histogram(band, low, high, buckets):
+    """Histogramme exact calculé en C par GDAL (NoData exclu), ou None pour une ArrayBand."""
+    if isinstance(band, ArrayBand):
+        return None
+    hist = band.GetHistogram(min=low, max=high, buckets=buckets, include_out_of_range=0, approx_ok=0)
+    return np.asarray(hist, dtype=np.int64)
+
+
+class ProcessingCanceled(Exception):
+    """Levée entre deux fenêtres lorsque l'utilisateur annule le traitement."""
+
+
+def read_windows(band, windows, nodata, cancel=None):
+    """Parcourt la bande bloc par bloc : (fenêtre, données, masque NoData ou None).
+
+    Les blocs sont lus dans un tampon réutilisé : ils ne sont valides que jusqu'au suivant.
+    Si l'événement cancel est levé, ProcessingCanceled interrompt le parcours avant la lecture suivante.
+    """
+    dtype = gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType)
+    for x, y, w, h in windows:
+        if cancel is not None and cancel.is_set():
+            raise ProcessingCanceled()
+        data = band.ReadAsArray(x, y, w, h, buf_obj=thread_buffer('read', (h, w), dtype))
+        mask = None
+        if nodata is not None:
+            mask = np.equal(data, nodata, out=thread_buffer('mask', (h, w), np.bool_))
+        yield (x, y, w, h), data, mask
+
+
+def valid_pixels(mask):
+    """Masque des pixels valides (where= des ufuncs), dans un tampon du thread."""
+    if mask is None:
+        return True
+    return np.logical_not(mask, out=thread_buffer('valid', mask.shape, np.bool_))
+
+
+def histogram_percentiles(hist, cut_percent):
+    """Indices des percentiles bas/haut lus sur un histogramme cumulé."""
+    cdf = hist.cumsum()
+    total = cdf[-1]
+    p_min = np.searchsorted(cdf, cut_percent / 100 * total, side='right')
+    p_max = np.searchsorted(cdf, (1 - cut_percent / 100) * total, side='left')
+    return int(p_min), int(min(p_max, len(cdf) - 1))
+
+
+def quantize(values, vmin, vmax, levels=256, scratch=None, out=None):
+    """Ramène linéairement les valeurs de [vmin, vmax] vers des indices 0..levels-1.
+
+    scratch (réel) et out (entier) permettent de réutiliser des tampons existants.
+    """
+    scale = (levels - 1) / (vmax - vmin) if vmax > vmin else 0.0
+    # Un seul tampon réel, réutilisé en place par chaque ufunc ; la soustraction se fait
+    # à la précision de l'entrée, la suite à celle du tampon (float32 le plus souvent)
+    scaled = np.subtract(values, float(vmin), out=scratch)
+    np.multiply(scaled, scaled.dtype.type(scale), out=scaled)
+    np.rint(scaled, out=scaled)
+    np.clip(scaled, scaled.dtype.type(0), scaled.dtype.type(levels - 1), out=scaled)
+    if out is None:
+        return scaled.astype(np.uint8 if levels <= 256 else np.uint16)
+    np.copyto(out, scaled, casting='unsafe')
+    return out
+
+
+def histogram_range(vmin, vmax, levels=256):
+    """Bornes de l'histogramme dont chaque classe est centrée sur un niveau de quantize()."""
+    step = (vmax - vmin) / (levels - 1) if vmax > vmin else 1.0
+    return vmin - step / 2, vmin + (levels - 0.5) * step
+
+
+def quantized_histogram(values, vmin, vmax, levels=256):
+    """Histogramme des indices que quantize() attribuerait, sans tableau intermédiaire.
+
+    Le range explicite active le chemin rapide à classes égales de np.histogram ;
+    les valeurs hors de ce range sont ignorées.
+    """
+    hist, _ = np.histogram(values, bins=levels, range=histogram_range(vmin, vmax, levels))
+    return hist
+
+
+def stretch_uint8(values, p_min, p_max, scratch=None, out=None):
+    """Étirement linéaire de [p_min, p_max] vers 0..255.
+
+    scratch (réel) et out (uint8) permettent de réutiliser des tampons existants.
+    """
+    # Clip, décalage et mise à l'échelle enchaînés en place dans un seul tampon, à sa précision
+    # (le clip compris) ; la division par l'étendue envoie exactement p_max sur 255
+    stretched = np.clip(values, float(p_min), float(p_max), out=scratch,
+                        dtype=None if scratch is None else scratch.dtype)
+    ftype = stretched.dtype.type
+    np.subtract(stretched, ftype(p_min), out=stretched)
+    if p_max > p_min:
+        np.divide(stretched, ftype(p_max - p_min), out=stretched)
+    else:
+        stretched.fill(0)
+    np.multiply(stretched, ftype(255), out=stretched)
+    if out is None:
+        return stretched.astype(np.uint8)
+    np.copyto(out, stretched, casting='unsafe')
+    return out
+
+
+def gamma_uint8(values, vmin, vmax, gamma, scratch=None, out=None):
+    """Correction gamma exacte de [vmin, vmax] vers 0..255, tronquée comme une conversion uint8.
+
+    scratch (réel) et out (uint8) permettent de réutiliser des tampons existants.
+    """
+    # Normalisation, puissance et mise à l'échelle enchaînées en place dans un seul tampon,
+    # toutes à sa précision (la soustraction comprise)
+    norm = np.subtract(values, float(vmin), out=scratch, dtype=None if scratch is None else scratch.dtype)
+    ftype = norm.dtype.type
+    if vmax > vmin:
+        np.divide(norm, ftype(vmax - vmin), out=norm)
+    else:
+        norm.fill(0)
+    np.clip(norm, ftype(0), ftype(1), out=norm)
+    np.power(norm, ftype(1.0 / gamma), out=norm)
+    np.multiply(norm, ftype(255), out=norm)
+    if out is None:
+        return norm.astype(np.uint8)
+    np.copyto(out, norm, casting='unsafe')
+    return out
+
+
+def equalization_lut(hist):
+    """Table de correspondance uint8 d'égalisation construite à partir d'un histogramme."""
+    cdf = hist.cumsum()
+    # On ignore les classes vides en tête pour que la première valeur présente donne 0
+    cdf_min = cdf[np.flatnonzero(hist)[0]]
+    if cdf[-1] > cdf_min:
+        lut = np.round((cdf - cdf_min) * (255.0 / (cdf[-1] - cdf_min)))
+    else:
+        lut = np.zeros(len(cdf))
+    return np.clip(lut, 0, 255).astype(np.uint8)
+
+
+@functools.lru_cache(maxsize=None)
+def numba_kernels():
+    """Module SpectralEnhancementKernels des noyaux Numba fusionnés, ou None si Numba n'est pas installé.
+
+    L'import n'a lieu qu'au premier appel ; la compilation est mise en cache sur disque.
+    Les noyaux libèrent le GIL : le parallélisme vient des threads de bandes, un noyau
+    parallel=True lancé hors du thread principal pouvant bloquer la fermeture de l'interpréteur.
+    """
+    try:
+        import numba  # noqa: F401
+    except ImportError:
+        return None
+    # Module voisin, que ce fichier soit chargé dans le paquet du plugin ou seul (tests)
+    package = __name__.rpartition('.')[0]
+    return importlib.import_module(f'{package}.SpectralEnhancementKernels' if package else 'SpectralEnhancementKernels')
+
+
+@functools.lru_cache(maxsize=None)
+def opencv_lut():
+    """cv2.LUT, vectorisé et sans GIL, ou None si OpenCV n'est pas installé.
+
+    Comme pour numba_kernels(), l'import n'a lieu qu'au premier appel.
+    """
+    try:
+        import cv2
+    except ImportError:
+        return None
+    return cv2.LUT
+
+
+def uint8_lut_transform(lut):
+    """Application d'une LUT de 256 entrées à un bloc uint8 : cv2.LUT si disponible, numpy sinon."""
+    cv_lut = opencv_lut()
+    if cv_lut is None:
+        def apply(data, out):
+            return np.take(lut, data, out=out)
+        return apply
+    # cv2.LUT exige une table uint8 contiguë
+    table = np.ascontiguousarray(lut, dtype=np.uint8)
+
+    def apply(data, out):
+        return cv_lut(data, table, dst=out)
+    return apply
+
+
+def zero_nodata(transform, nodata):
+    """Enveloppe un rehaussement numpy d'un bloc pour renvoyer le NoData sur 0."""
+    if nodata is None:
+        return transform
+
+    def apply(data, out):
+        transform(data, out)
+        np.putmask(out, np.equal(data, nodata, out=thread_buffer('mask', data.shape, np.bool_)), 0)
+        return out
+    return apply
+
+
+def lut_transform(lut, vmin, vmax):
+    """Rehaussement numpy d'un bloc réel via une LUT sur 256 niveaux quantifiés."""
+    take = uint8_lut_transform(lut)
+
+    def apply(data, out):
+        idx = quantize(data, vmin, vmax,
+                       scratch=thread_buffer('scratch', data.shape, work_dtype(data.dtype)),
+                       out=thread_buffer('index', data.shape, np.uint8))
+        return take(idx, out)
+    return apply
+
+
+def stretch_transform(p_min, p_max):
+    """Étirement numpy d'un bloc réel dans les tampons du thread."""
+    def apply(data, out):
+        scratch = thread_buffer('scratch', data.shape, work_dtype(data.dtype))
+        return stretch_uint8(data, p_min, p_max, scratch=scratch, out=out)
+    return apply
+
+
+def gamma_transform(vmin, vmax, gamma):
+    """Correction gamma numpy exacte d'un bloc réel, en float64 comme le noyau Numba."""
+    def apply(data, out):
+        scratch = thread_buffer('scratch', data.shape, np.float64)
+        return gamma_uint8(data, vmin, vmax, gamma, scratch=scratch, out=out)
+    return apply
+
+
+def nodata_index(nodata, offset, size):
+    """Indice du NoData dans le domaine entier, ou None s'il n'y figure pas."""
+    if nodata is None or not float(nodata).is_integer():
+        return None
+    index = int(nodata) + offset
+    return index if 0 <= index < size else None
+
+
+def integer_band_lut(band, windows, nodata, method_index, cut_percent, gamma, cancel=None):
+    """Premier passage d'une bande entière : histogramme global puis LUT sur tout le domaine.
+
+    Le NoData est retiré de l'histogramme et envoyé sur 0 par la LUT, sans aucun masque.
+    Retourne None si la bande ne contient aucun pixel valide.
+    """
+    offset, size = integer_domain(band.DataType)
+    hist = None
+    if method_index == 0: # Linear Stretch
+        # Une classe par valeur entière : les percentiles restent exacts
+        hist = gdal_histogram(band, -offset - 0.5, size - offset - 0.5, size)
+    if hist is None:
+        hist = np.zeros(size, dtype=np.int64)
+        kernels = numba_kernels()
+        for _, data, _ in read_windows(band, windows, None, cancel):
+            if kernels is not None:
+                kernels.accumulate_histogram(data, offset, hist)
+            else:
+                hist += np.bincount(to_indices(data.ravel(), offset), minlength=size)
+
+    nodata_idx = nodata_index(nodata, offset, size)
+    if nodata_idx is not None:
+        hist[nodata_idx] = 0
+
+    present = np.flatnonzero(hist)
+    if present.size == 0:
+        return None
+    values = np.arange(size) - offset
+    vmin, vmax = present[0] - offset, present[-1] - offset
+
+    if method_index == 0: # Linear Stretch
+        if cut_percent == 0:
+            p_min, p_max = vmin, vmax
+        else:
+            p_min, p_max = histogram_percentiles(hist, cut_percent)
+            p_min, p_max = p_min - offset, p_max - offset
+        lut = stretch_uint8(values, p_min, p_max)
+    elif method_index == 1: # Equalization
+        # Indices 0..255 : directs pour Byte, quantifiés sinon
+        if band.DataType == gdal.GDT_Byte:
+            lut = equalization_lut(hist)
+        else:
+            idx = quantize(values, vmin, vmax)
+            lut = equalization_lut(np.bincount(idx, weights=hist, minlength=256))[idx]
+    else: # Gamma Correction
+        # Une entrée par valeur entière : la correction exacte ne coûte pas plus cher
+        lut = gamma_uint8(values, vmin, vmax, gamma)
+
+    if nodata_idx is not None:
+        lut[nodata_idx] = 0
+    return lut
+
+
+def float_stretch_transform(p_min, p_max, nodata, kernels):
+    """Étirement d'un bloc réel : noyau Numba si disponible, numpy sinon."""
+    if kernels is None:
+        return zero_nodata(stretch_transform(p_min, p_max), nodata)
+    has_nodata, nodata_value = nodata is not None, nodata if nodata is not None else 0.0
+
+    def apply(data, out):
+        kernels.apply_stretch_float(data, nodata_value, has_nodata, p_min, p_max, out)
+        return out
+    return apply
+
+
+def reduction_bounds(dtype):
+    """Bornes du type, valeurs initiales des np.min/np.max restreints par where=.
+
+    ±inf n'est pas représentable pour les entiers (Int32, UInt32) qui suivent la voie réelle.
+    """
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        return info.min, info.max
+    return -np.inf, np.inf
+
+
+def float_band_range(band, windows, nodata, kernels, cancel=None):
+    """Min, max et nombre de pixels valides d'une bande réelle, en un seul passage."""
+    vmin, vmax, count = np.inf, -np.inf, 0
+    if kernels is not None:
+        # Min et max accumulés ensemble, sans masque ni copie des pixels valides
+        has_nodata, nodata_value = nodata is not None, nodata if nodata is not None else 0.0
+        for _, data, _ in read_windows(band, windows, None, cancel):
+            lo, hi, n = kernels.minmax_float(data, nodata_value, has_nodata)
+            vmin, vmax, count = min(vmin, lo), max(vmax, hi), count + n
+    else:
+        for _, data, mask in read_windows(band, windows, nodata, cancel):
+            # Réductions restreintes par where= : aucune copie compactée des pixels valides
+            n = data.size - (np.count_nonzero(mask) if mask is not None else 0)
+            if n:
+                valid = valid_pixels(mask)
+                lo, hi = reduction_bounds(data.dtype)
+                vmin = min(vmin, np.min(data, where=valid, initial=hi))
+                vmax = max(vmax, np.max(data, where=valid, initial=lo))
+                count += n
+    return float(vmin), float(vmax), count
+
+
+def float_band_transform(band, windows, nodata, method_index, cut_percent, gamma, cancel=None):
+    """Passages statistiques d'une bande réelle ; retourne la fonction appliquée à chaque bloc.
+
+    La fonction retournée envoie elle-même le NoData sur 0.
+    Retourne None si la bande ne contient aucun pixel valide.
+    """
+    kernels = numba_kernels()
+    vmin, vmax, count = float_band_range(band, windows, nodata, kernels, cancel)
+    if count == 0:
+        return None
+    has_nodata, nodata_value = nodata is not None, nodata if nodata is not None else 0.0
+
+    if method_index == 2: # Gamma Correction
+        if kernels is not None:
+            # Calcul exact par pixel, fusionné en un seul passage sans temporaire
+            def apply(data, out):
+                kernels.apply_gamma_float(data, nodata_value, has_nodata, vmin, vmax - vmin, 1.0 / gamma, out)
+                return out
+            return apply
+        return zero_nodata(gamma_transform(vmin, vmax, gamma), nodata)
+
+    if method_index == 0 and cut_percent == 0:
+        # Étirement complet : les percentiles 0 et 100 sont le min et le max, sans histogramme
+        return float_stretch_transform(vmin, vmax, nodata, kernels)
+
+    # Stretch et égalisation ont besoin d'un histogramme global de la bande
+    levels = FLOAT_HIST_LEVELS if method_index == 0 else 256
+    low, high = histogram_range(vmin, vmax, levels)
+    hist = gdal_histogram(band, low, high, levels) if method_index == 0 else None
+    if hist is None:
+        hist = np.zeros(levels, dtype=np.int64)
+        # Un NoData hors du range est déjà écarté par np.histogram : aucun masque à construire
+        hist_nodata = nodata if nodata is not None and low <= nodata <= high else None
+        nodata_count, dtype = 0, None
+        for _, data, mask in read_windows(band, windows, hist_nodata, cancel):
+            hist += quantized_histogram(data, vmin, vmax, levels)
+            if mask is not None:
+                nodata_count, dtype = nodata_count + np.count_nonzero(mask), data.dtype
+        if nodata_count:
+            # Le NoData tombe tout entier dans une seule classe : on l'en retire après coup
+            # plutôt que de compacter les pixels valides de chaque bloc
+            hist -= nodata_count * quantized_histogram(np.full(1, nodata, dtype), vmin, vmax, levels)
+
+    if method_index == 0: # Linear Stretch
+        # Percentiles approchés à (vmax - vmin) / 65535 près
+        step = (vmax - vmin) / (levels - 1)
+        p_min, p_max = histogram_percentiles(hist, cut_percent)
+        p_min, p_max = vmin + p_min * step, vmin + p_max * step
+        return float_stretch_transform(p_min, p_max, nodata, kernels)
+
+    # Equalization
+    return zero_nodata(lut_transform(equalization_lut(hist), vmin, vmax), nodata)
+
+
+def enhance_band(band, out_band, write_lock, method_index, cut_percent, gamma, workers=1, cancel=None):
+    """Rehausse une bande bloc par bloc et l'écrit dans out_band.
+
+    Les écritures sont sérialisées par write_lock, le dataset de sortie étant partagé.
+    Retourne False si la bande est vide ou entièrement NoData ; lève ProcessingCanceled
+    dès que l'événement cancel est levé.
+    """
+    nodata = band.GetNoDataValue()
+    windows = block_windows(band, workers)
+
+    if band.DataType in INTEGER_TYPES:
+        lut = integer_band_lut(band, windows, nodata, method_index, cut_percent, gamma, cancel)
+        if lut is None:
+            return False
+        offset, _ = integer_domain(band.DataType)
+        # Le NoData est déjà envoyé sur 0 par la LUT
+        kernels = numba_kernels()
+        if band.DataType == gdal.GDT_Byte and np.array_equal(lut, np.arange(256)):
+            # Bande Byte déjà étalée sur 0..255 : LUT identité, les blocs sont écrits tels quels
+            def transform(data, out):
+                return data
+        elif band.DataType == gdal.GDT_Byte and opencv_lut() is not None:
+            transform = uint8_lut_transform(lut)
+        elif kernels is not None:
+            def transform(data, out):
+                kernels.apply_lut(data, offset, lut, out)
+                return out
+        else:
+            def transform(data, out):
+                return np.take(lut, to_indices(data, offset), out=out)
+    else:
+        transform = float_band_transform(band, windows, nodata, method_index, cut_percent, gamma, cancel)
+        if transform is None:
+            return False
+
+    # Dernier passage : application du rehaussement et écriture bloc par bloc
+    for (x, y, w, h), data, _ in read_windows(band, windows, None, cancel):
+        output_data = transform(data, thread_buffer('output', data.shape, np.uint8))
+        with write_lock:
+            out_band.WriteArray(output_data, xoff=x, yoff=y)
+            # Vidage du cache uniquement quand une rangée de tuiles de sortie est complète
+            if x + w == band.XSize and ((y + h) % OUTPUT_BLOCK_SIZE == 0 or y + h == band.YSize):
+                out_band.FlushCache()
+    return True
+
 
 class SpectralRasterEnhancementAlgorithm(QgsProcessingAlgorithm):
     INPUT_RASTER = 'INPUT_RASTER'
@@ -117,6 +689,10 @@ class SpectralRasterEnhancementAlgorithm(QgsProcessingAlgorithm):
             raise QgsProcessingException(self.tr('Invalid layer'))
 
         raster_path = raster_layer.source()
+
+        # Décodage multi-thread des bandes compressées, rétabli en fin de traitement
+        num_threads = gdal.GetConfigOption('GDAL_NUM_THREADS')
+        gdal.SetConfigOption('GDAL_NUM_THREADS', 'ALL_CPUS')
         
         try:
             ds = gdal.Open(raster_path)
@@ -130,83 +706,65 @@ class SpectralRasterEnhancementAlgorithm(QgsProcessingAlgorithm):
             # Préparation du raster de sortie avec le même nombre de bandes
             driver = gdal.GetDriverByName('GTiff')
             cols, rows = ds.RasterXSize, ds.RasterYSize
-            out_ds = driver.Create(output_path, cols, rows, band_count, gdal.GDT_Byte)
+            out_ds = driver.Create(output_path, cols, rows, band_count, gdal.GDT_Byte, options=GTIFF_OPTIONS)
             out_ds.SetGeoTransform(ds.GetGeoTransform())
             out_ds.SetProjection(ds.GetProjection())
 
-            # Boucle sur chaque bande
-            for i in range(1, band_count + 1):
-                if feedback.isCanceled():
-                    break
-
-                feedback.pushInfo(f"Processing Band {i}/{band_count}...")
-                
-                band = ds.GetRasterBand(i)
-                data = band.ReadAsArray().astype(np.float64)
-                
-                nodata = band.GetNoDataValue()
-                if nodata is not None:
-                    mask = (data == nodata)
+            workers = min(band_count, os.cpu_count() or 1)
+            write_lock = threading.Lock()
+            # Levé par la boucle principale, vérifié par les bandes en cours entre deux fenêtres
+            cancel = threading.Event()
+
+            # Petits rasters : une seule lecture pour toutes les bandes
+            cube_bands = read_cube(ds)
+
+            def process_band(i):
+                if cube_bands is not None:
+                    band = cube_bands[i - 1]
                 else:
-                    mask = np.zeros_like(data, dtype=bool)
-                
-                valid_data = data[~mask]
-                
-                if valid_data.size == 0:
-                    feedback.pushWarning(f"Band {i} is empty or fully NoData. Skipping.")
-                    continue
-
-                output_data = np.zeros_like(data, dtype=np.uint8)
-
-                if method_index == 0: # Linear Stretch
-                    # Calcul des percentiles pour cette bande spécifique
-                    p_min = np.percentile(valid_data, cut_percent)
-                    p_max = np.percentile(valid_data, 100 - cut_percent)
-                    
-                    stretched = np.clip(valid_data, p_min, p_max)
-                    stretched = ((stretched - p_min) / (p_max - p_min) * 255).astype(np.uint8)
-                    output_data[~mask] = stretched
-
-                elif method_index == 1: # Equalization
-                    # Histogramme et CDF spécifiques à cette bande
-                    hist, bins = np.histogram(valid_data.flatten(), bins=256, range=(valid_data.min(), valid_data.max()))
-                    cdf = hist.cumsum()
-                    cdf_min = cdf.min()
-                    cdf_max = cdf.max()
-                    
-                    if cdf_max > cdf_min:
-                        cdf = (cdf - cdf_min) * 255 / (cdf_max - cdf_min)
-                    else:
-                        cdf = np.zeros_like(cdf)
-                    cdf = cdf.astype(np.uint8)
-                    
-                    bins_center = (bins[:-1] + bins[1:]) / 2
-                    equalized = np.interp(valid_data.flatten(), bins_center, cdf).reshape(valid_data.shape).astype(np.uint8)
-                    output_data[~mask] = equalized
-
-                elif method_index == 2: # Gamma Correction
-                    min_val = valid_data.min()
-                    max_val = valid_data.max()
-                    range_val = max_val - min_val
-                    
-                    if range_val == 0:
-                        norm = np.zeros_like(valid_data)
-                    else:
-                        norm = (valid_data - min_val) / range_val
-                    
-                    gamma_corrected = np.power(norm, 1.0 / gamma)
-                    output_data[~mask] = (gamma_corrected * 255).astype(np.uint8)
-
-                output_data[mask] = 0
-
-                # Écriture de la bande traitée
-                out_band = out_ds.GetRasterBand(i)
-                out_band.WriteArray(output_data)
-                out_band.SetNoDataValue(0)
-                # Libération de la mémoire pour la bande écrite
-                out_band.FlushCache()
+                    # Chaque thread ouvre son propre dataset : les handles GDAL ne sont pas thread-safe
+                    src_ds = gdal.Open(raster_path)
+                    band = src_ds.GetRasterBand(i)
+                with write_lock:
+                    out_band = out_ds.GetRasterBand(i)
+                # Lecture, rehaussement et écriture par blocs alignés sur ceux de GDAL
+                return enhance_band(band, out_band, write_lock,
+                                    method_index, cut_percent, gamma, workers, cancel)
+
+            # Les bandes sont indépendantes : traitement parallèle
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {}
+                if not feedback.isCanceled():
+                    futures = {pool.submit(process_band, i): i for i in range(1, band_count + 1)}
+                pending = set(futures)
+                try:
+                    while pending:
+                        # Attente bornée : l'annulation est relevée même pendant une longue bande
+                        done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                        if feedback.isCanceled():
+                            cancel.set()
+                            for future in pending:
+                                future.cancel()
+                            break
+
+                        for future in sorted(done, key=futures.get):
+                            i = futures[future]
+                            if not future.result():
+                                feedback.pushWarning(f"Band {i} is empty or fully NoData. Skipping.")
+                                continue
+
+                            feedback.pushInfo(f"Band {i}/{band_count} processed.")
+                            with write_lock:
+                                out_ds.GetRasterBand(i).SetNoDataValue(0)
+                except BaseException:
+                    # Une bande en erreur arrête les autres : sinon la sortie du pool les attendrait toutes
+                    cancel.set()
+                    for future in pending:
+                        future.cancel()
+                    raise
             
             # Fermeture propre des datasets
+            cube_bands = None
             out_ds = None
             ds = None
             feedback.pushInfo("✅ Complete")
@@ -217,4 +775,7 @@ class SpectralRasterEnhancementAlgorithm(QgsProcessingAlgorithm):
             feedback.pushInfo(traceback.format_exc())
             return {}
 
+        finally:
+            gdal.SetConfigOption('GDAL_NUM_THREADS', num_threads)
+
         return {self.OUTPUT_RASTER: output_path}
\ No newline at end of file
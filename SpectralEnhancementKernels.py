@@ -0,0 +1,78 @@
+"""Noyaux Numba de SpectralEnhancementAlgorithm, importés seulement si Numba est installé.
+
+cache=True conserve la compilation sur disque : seule la première session la paie.
+"""
+import numba
+import numpy as np
+
+
+jit = numba.njit(nogil=True, fastmath=True, cache=True)
+
+
+# Sans fastmath : les comparaisons doivent rester correctes pour inf et NaN
+@numba.njit(nogil=True, cache=True)
+def minmax_float(data, nodata, has_nodata):
+    rows, cols = data.shape
+    vmin, vmax, count = np.inf, -np.inf, 0
+    for i in range(rows):
+        for j in range(cols):
+            value = data[i, j]
+            if has_nodata and value == nodata:
+                continue
+            if value < vmin:
+                vmin = value
+            if value > vmax:
+                vmax = value
+            count += 1
+    return vmin, vmax, count
+
+
+# Sans fastmath non plus : mêmes opérations float64 que gamma_uint8(), pour que
+# l'image ne dépende pas de la présence de Numba
+@numba.njit(nogil=True, cache=True)
+def apply_gamma_float(data, nodata, has_nodata, min_val, span, inv_gamma, out):
+    rows, cols = data.shape
+    for i in range(rows):
+        for j in range(cols):
+            value = data[i, j]
+            if has_nodata and value == nodata:
+                out[i, j] = 0
+            else:
+                norm = (value - min_val) / span if span > 0 else 0.0
+                norm = min(max(norm, 0.0), 1.0)
+                out[i, j] = np.uint8(norm ** inv_gamma * 255.0)
+
+
+# Sans fastmath : la division par l'étendue, qui envoie exactement p_max sur 255,
+# ne doit pas redevenir un produit par son inverse
+@numba.njit(nogil=True, cache=True)
+def apply_stretch_float(data, nodata, has_nodata, p_min, p_max, out):
+    span = p_max - p_min
+    rows, cols = data.shape
+    for i in range(rows):
+        for j in range(cols):
+            value = data[i, j]
+            if has_nodata and value == nodata:
+                out[i, j] = 0
+            elif span > 0:
+                out[i, j] = np.uint8((min(max(value, p_min), p_max) - p_min) / span * 255.0)
+            else:
+                out[i, j] = 0
+
+
+# Histogramme et LUT entiers indexés directement par les pixels : np.bincount et
+# np.take convertiraient d'abord chaque bloc en indices intp (8 octets par pixel)
+@jit
+def accumulate_histogram(data, offset, hist):
+    rows, cols = data.shape
+    for i in range(rows):
+        for j in range(cols):
+            hist[data[i, j] + offset] += 1
+
+
+@jit
+def apply_lut(data, offset, lut, out):
+    rows, cols = data.shape
+    for i in range(rows):
+        for j in range(cols):
+            out[i, j] = lut[data[i, j] + offset]
@@ -0,0 +1,44 @@
+"""Substitut minimal de qgis quand QGIS n'est pas installé : seuls les calculs GDAL/numpy sont testés."""
+import sys
+import types
+
+try:
+    import qgis.core  # noqa: F401
+except ImportError:
+    class _Parameter:
+        Double = 1
+
+        def __init__(self, *args, **kwargs):
+            pass
+
+    class QgsProcessingAlgorithm:
+        def addParameter(self, parameter):
+            pass
+
+    class QCoreApplication:
+        @staticmethod
+        def translate(context, string):
+            return string
+
+    class QIcon:
+        def __init__(self, *args):
+            pass
+
+    core = types.ModuleType('qgis.core')
+    core.QgsProcessing = type('QgsProcessing', (), {})
+    core.QgsProcessingAlgorithm = QgsProcessingAlgorithm
+    core.QgsProcessingException = type('QgsProcessingException', (Exception,), {})
+    for name in ('QgsProcessingParameterRasterLayer', 'QgsProcessingParameterEnum',
+                 'QgsProcessingParameterNumber', 'QgsProcessingParameterRasterDestination'):
+        setattr(core, name, type(name, (_Parameter,), {}))
+    qtcore = types.ModuleType('qgis.PyQt.QtCore')
+    qtcore.QCoreApplication = QCoreApplication
+    qtgui = types.ModuleType('qgis.PyQt.QtGui')
+    qtgui.QIcon = QIcon
+
+    qgis = types.ModuleType('qgis')
+    pyqt = types.ModuleType('qgis.PyQt')
+    qgis.core, qgis.PyQt = core, pyqt
+    pyqt.QtCore, pyqt.QtGui = qtcore, qtgui
+    sys.modules.update({'qgis': qgis, 'qgis.core': core, 'qgis.PyQt': pyqt,
+                        'qgis.PyQt.QtCore': qtcore, 'qgis.PyQt.QtGui': qtgui})
@@ -0,0 +1,257 @@
+"""Rehaussement d'une bande sur des rasters GDAL en mémoire."""
+import os
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip('osgeo.gdal')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import SpectralEnhancementAlgorithm as sea  # noqa: E402
+
+
+class TiledBand:
+    """Bande réduite à sa géométrie, pour block_windows()."""
+
+    def __init__(self, cols, rows, block, data_type):
+        self.XSize, self.YSize, self.DataType = cols, rows, data_type
+        self._block = list(block)
+
+    def GetBlockSize(self):
+        return self._block
+
+
+def mem_band(data, data_type, nodata=None):
+    """Dataset MEM d'une bande contenant data ; le dataset doit rester référencé."""
+    rows, cols = data.shape
+    ds = gdal.GetDriverByName('MEM').Create('', cols, rows, 1, data_type)
+    band = ds.GetRasterBand(1)
+    band.WriteArray(data)
+    if nodata is not None:
+        band.SetNoDataValue(nodata)
+    return ds, band
+
+
+INTEGER_TYPES = [(np.uint8, 'GDT_Byte'), (np.uint16, 'GDT_UInt16'), (np.int16, 'GDT_Int16')]
+
+
+def integer_data(dtype, shape, seed=0):
+    info = np.iinfo(dtype)
+    return np.random.default_rng(seed).integers(info.min, info.max, shape, endpoint=True).astype(dtype)
+
+
+def enhance(data, data_type, method_index, cut_percent=2.0, gamma=1.0, nodata=None):
+    """Sortie uint8 d'enhance_band pour une bande contenant data."""
+    src_ds, band = mem_band(data, data_type, nodata)
+    out_ds, out_band = mem_band(np.zeros(data.shape, np.uint8), gdal.GDT_Byte)
+    assert sea.enhance_band(band, out_band, threading.Lock(), method_index, cut_percent, gamma)
+    return out_band.ReadAsArray()
+
+
+@pytest.mark.parametrize('cut_percent', [0.0, 2.0])
+@pytest.mark.parametrize('dtype, data_type', INTEGER_TYPES)
+def test_integer_lut_stretch_matches_per_pixel_stretch(dtype, data_type, cut_percent):
+    data = integer_data(dtype, (300, 200))
+    out = enhance(data, getattr(gdal, data_type), 0, cut_percent)
+
+    values = data.astype(np.float64)
+    low, high = np.percentile(values, cut_percent), np.percentile(values, 100 - cut_percent)
+    expected = ((np.clip(values, low, high) - low) / (high - low) * 255).astype(np.uint8)
+    # Les percentiles tirés de l'histogramme ne diffèrent de np.percentile que par l'arrondi
+    assert np.abs(out.astype(int) - expected).max() <= 1
+
+
+@pytest.mark.parametrize('method_index', [0, 1, 2])
+@pytest.mark.parametrize('dtype, data_type', INTEGER_TYPES)
+def test_nodata_folded_into_lut(dtype, data_type, method_index):
+    # NoData au milieu de la plage : la LUT doit l'envoyer sur 0 sans fausser les statistiques
+    data = integer_data(dtype, (300, 200))
+    nodata = int(np.iinfo(dtype).min // 2 + np.iinfo(dtype).max // 2)
+    data[data == nodata] = nodata + 1
+    rows = np.arange(data.shape[0]) % 7 == 0
+    data[rows] = nodata
+
+    out = enhance(data, getattr(gdal, data_type), method_index, gamma=2.2, nodata=nodata)
+
+    assert not out[rows].any()
+    # Les pixels valides sont rehaussés comme une bande qui ne contiendrait qu'eux
+    np.testing.assert_array_equal(out[~rows], enhance(data[~rows], getattr(gdal, data_type), method_index, gamma=2.2))
+
+
+@pytest.mark.parametrize('nodata', [None, -9999])
+@pytest.mark.parametrize('method_index', [0, 1, 2])
+def test_int32_band_numpy_fallback(monkeypatch, method_index, nodata):
+    # Int32 suit la voie réelle ; sans Numba, ce sont les réductions numpy qui servent
+    monkeypatch.setattr(sea, 'numba_kernels', lambda: None)
+    data = np.random.default_rng(0).integers(-100000, 100000, (300, 200), dtype=np.int32)
+    if nodata is not None:
+        data[::7] = nodata
+    src_ds, band = mem_band(data, gdal.GDT_Int32, nodata)
+    out_ds, out_band = mem_band(np.zeros(data.shape, np.uint8), gdal.GDT_Byte)
+
+    assert sea.enhance_band(band, out_band, threading.Lock(), method_index, 2.0, 2.2)
+
+    out = out_band.ReadAsArray()
+    valid = data != nodata
+    assert out[valid].min() == 0
+    assert out[valid].max() == 255
+    assert not out[~valid].any()
+
+
+@pytest.mark.parametrize('workers', [1, 8])
+@pytest.mark.parametrize('block', [(300, 300), (1000, 1000), (256, 256), (512, 512), (30000, 1), (30000, 30000)])
+def test_block_windows_stay_within_budget(workers, block):
+    band = TiledBand(30000, 30000, block, gdal.GDT_Float32)
+    windows = sea.block_windows(band, workers)
+    # Budget de block_windows : la lecture Float32 plus les tampons de travail
+    budget = gdal.GetCacheMax() // 2 // ((4 + sea.THREAD_BUFFER_BYTES) * workers)
+    assert max(w * h for _, _, w, h in windows) <= budget
+    assert sum(w * h for _, _, w, h in windows) == band.XSize * band.YSize
+
+
+def test_enhance_band_stops_when_canceled():
+    data = np.arange(300 * 200, dtype=np.uint16).reshape(300, 200)
+    src_ds, band = mem_band(data, gdal.GDT_UInt16)
+    out_ds, out_band = mem_band(np.zeros(data.shape, np.uint8), gdal.GDT_Byte)
+    cancel = threading.Event()
+    cancel.set()
+
+    with pytest.raises(sea.ProcessingCanceled):
+        sea.enhance_band(band, out_band, threading.Lock(), 1, 2.0, 1.0, cancel=cancel)
+    assert not out_band.ReadAsArray().any()
+
+
+@pytest.mark.parametrize('gamma', [0.5, 2.2, 10.0])
+@pytest.mark.parametrize('dtype, data_type', [(np.uint16, 'GDT_UInt16'), (np.int16, 'GDT_Int16')])
+def test_integer_gamma_matches_per_pixel_power(dtype, data_type, gamma):
+    info = np.iinfo(dtype)
+    data = np.random.default_rng(0).integers(info.min, info.max, (300, 200), endpoint=True).astype(dtype)
+    src_ds, band = mem_band(data, getattr(gdal, data_type))
+    out_ds, out_band = mem_band(np.zeros(data.shape, np.uint8), gdal.GDT_Byte)
+
+    assert sea.enhance_band(band, out_band, threading.Lock(), 2, 2.0, gamma)
+
+    values = data.astype(np.int64)
+    vmin, vmax = values.min(), values.max()
+    expected = (np.power((values - vmin) / (vmax - vmin), 1.0 / gamma) * 255).astype(np.uint8)
+    np.testing.assert_array_equal(out_band.ReadAsArray(), expected)
+
+
+@pytest.mark.parametrize('gamma', [0.5, 2.2, 10.0])
+@pytest.mark.parametrize('backend', ['numpy', 'numba'])
+def test_float_gamma_is_exact_with_and_without_numba(monkeypatch, backend, gamma):
+    if backend == 'numpy':
+        monkeypatch.setattr(sea, 'numba_kernels', lambda: None)
+    else:
+        pytest.importorskip('numba')
+    data = np.random.default_rng(0).normal(10, 3, (300, 200)).astype(np.float32)
+    data[::5] = -9999
+    src_ds, band = mem_band(data, gdal.GDT_Float32, -9999)
+    out_ds, out_band = mem_band(np.zeros(data.shape, np.uint8), gdal.GDT_Byte)
+
+    assert sea.enhance_band(band, out_band, threading.Lock(), 2, 2.0, gamma)
+
+    valid = data != -9999
+    values = data.astype(np.float64)
+    vmin, vmax = values[valid].min(), values[valid].max()
+    expected = (np.power(np.clip((values - vmin) / (vmax - vmin), 0, 1), 1.0 / gamma) * 255).astype(np.uint8)
+    expected[~valid] = 0
+    np.testing.assert_array_equal(out_band.ReadAsArray(), expected)
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.uint16, np.int16])
+def test_float32_scratch_matches_float64(dtype):
+    # Tampon float32 de work_dtype() contre un calcul en double précision
+    rng = np.random.default_rng(0)
+    if dtype == np.float32:
+        values = rng.normal(0.2, 0.05, 10 ** 6).astype(dtype)
+    else:
+        values = integer_data(dtype, 10 ** 6)
+    vmin, vmax = float(values.min()), float(values.max())
+    p_min, p_max = np.percentile(values, [2, 98])
+    assert sea.work_dtype(values.dtype) == np.float32
+
+    for compute in (lambda scratch: sea.quantize(values, vmin, vmax, scratch=scratch),
+                    lambda scratch: sea.stretch_uint8(values, p_min, p_max, scratch=scratch)):
+        single = compute(np.empty(values.shape, np.float32)).astype(int)
+        double = compute(np.empty(values.shape, np.float64)).astype(int)
+        diff = np.abs(single - double)
+        assert diff.max() <= 1
+        assert np.count_nonzero(diff) <= values.size // 10 ** 4
+
+
+@pytest.mark.parametrize('dtype, data_type, nodata', [(np.uint16, 'GDT_UInt16', 0), (np.int16, 'GDT_Int16', -1),
+                                                      (np.float32, 'GDT_Float32', -9999)])
+def test_gdal_histogram_matches_numpy_histogram(dtype, data_type, nodata):
+    # band.GetHistogram() contre le np.bincount / np.histogram d'une ArrayBand
+    rng = np.random.default_rng(0)
+    if dtype == np.float32:
+        data = rng.normal(10, 3, (300, 200)).astype(dtype)
+    else:
+        data = integer_data(dtype, (300, 200))
+    data[::7] = nodata
+    src_ds, band = mem_band(data, getattr(gdal, data_type), nodata)
+    outputs = []
+    for source in (band, sea.ArrayBand(band, band.ReadAsArray())):
+        out_ds, out_band = mem_band(np.zeros(data.shape, np.uint8), gdal.GDT_Byte)
+        assert sea.enhance_band(source, out_band, threading.Lock(), 0, 2.0, 1.0)
+        outputs.append(out_band.ReadAsArray().astype(int))
+
+    if dtype == np.float32:
+        # Bornes de classes calculées différemment par GDAL : un niveau d'écart au plus
+        assert np.abs(outputs[0] - outputs[1]).max() <= 1
+    else:
+        offset, size = sea.integer_domain(band.DataType)
+        valid = data[data != nodata].astype(np.int64) + offset
+        np.testing.assert_array_equal(sea.gdal_histogram(band, -offset - 0.5, size - offset - 0.5, size),
+                                      np.bincount(valid, minlength=size))
+        np.testing.assert_array_equal(outputs[0], outputs[1])
+
+
+@pytest.mark.parametrize('dtype, data_type', INTEGER_TYPES)
+def test_numba_integer_kernels_match_numpy(dtype, data_type):
+    pytest.importorskip('numba')
+    kernels = sea.numba_kernels()
+    data = integer_data(dtype, (300, 200))
+    offset, size = sea.integer_domain(getattr(gdal, data_type))
+    indices = data.astype(np.int64) + offset
+
+    hist = np.zeros(size, dtype=np.int64)
+    kernels.accumulate_histogram(data, offset, hist)
+    np.testing.assert_array_equal(hist, np.bincount(indices.ravel(), minlength=size))
+
+    lut = np.random.default_rng(1).integers(0, 256, size).astype(np.uint8)
+    out = np.empty(data.shape, np.uint8)
+    kernels.apply_lut(data, offset, lut, out)
+    np.testing.assert_array_equal(out, np.take(lut, indices))
+
+
+@pytest.mark.parametrize('method_index', [0, 1, 2])
+@pytest.mark.parametrize('dtype, data_type', INTEGER_TYPES)
+def test_integer_band_same_with_and_without_numba(monkeypatch, dtype, data_type, method_index):
+    pytest.importorskip('numba')
+    data = integer_data(dtype, (300, 200))
+    compiled = enhance(data, getattr(gdal, data_type), method_index, gamma=2.2, nodata=7)
+    monkeypatch.setattr(sea, 'numba_kernels', lambda: None)
+    np.testing.assert_array_equal(enhance(data, getattr(gdal, data_type), method_index, gamma=2.2, nodata=7), compiled)
+
+
+def test_opencv_lut_matches_numpy_take(monkeypatch):
+    pytest.importorskip('cv2')
+    data = integer_data(np.uint8, (300, 200))
+    lut = np.random.default_rng(1).integers(0, 256, 256).astype(np.uint8)
+    out = sea.uint8_lut_transform(lut)(data, np.empty(data.shape, np.uint8))
+    monkeypatch.setattr(sea, 'opencv_lut', lambda: None)
+    np.testing.assert_array_equal(out, sea.uint8_lut_transform(lut)(data, np.empty(data.shape, np.uint8)))
+    np.testing.assert_array_equal(out, np.take(lut, data))
+
+
+@pytest.mark.parametrize('method_index', [0, 1, 2])
+def test_byte_band_same_with_and_without_opencv(monkeypatch, method_index):
+    pytest.importorskip('cv2')
+    data = integer_data(np.uint8, (300, 200))
+    with_cv2 = enhance(data, gdal.GDT_Byte, method_index, gamma=2.2, nodata=7)
+    monkeypatch.setattr(sea, 'opencv_lut', lambda: None)
+    np.testing.assert_array_equal(enhance(data, gdal.GDT_Byte, method_index, gamma=2.2, nodata=7), with_cv2)